@@ -1,29 +1,175 @@
 import os
+import io
+import re
 import requests
-from bs4 import BeautifulSoup
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve
+import orjson
+import hashlib
+import sqlite3
 from dotenv import load_dotenv
-import facebook
-from apscheduler.schedulers.blocking import BlockingScheduler
 import time
+import heapq
+import random
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 
 # Load environment variables from .env file
 load_dotenv()
 
+@dataclass(frozen=True)
+class Config:
+    """Credentials read once from the environment at startup."""
+    openrouter_api_key: str
+    facebook_page_id: str
+    facebook_access_token: str
+
+CONFIG = Config(
+    openrouter_api_key=os.getenv("OPENROUTER_API_KEY", ""),
+    facebook_page_id=os.getenv("FACEBOOK_PAGE_ID", ""),
+    facebook_access_token=os.getenv("FACEBOOK_ACCESS_TOKEN", ""),
+)
+
 # --- Constants and Setup ---
-POSTED_ARTICLES_FILE = "posted_articles.txt"
+POSTED_ARTICLES_FILE = "posted_articles.txt" # Legacy history, imported into POSTED_DB_FILE once
+POSTED_DB_FILE = "posted_articles.db"
+LEGACY_TRANSLATION_CACHE_FILE = "translation_cache.jsonl" # Superseded by the translations table; removed on startup
 POSTED_IMAGES_FILE = "posted_images.txt"
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_MODEL = "openai/gpt-oss-20b:free" # Using the specified free model from user's cURL
+PROMPT_VERSION = 2 # Bump when the prompts change so cached translations are not reused
+TRANSLATION_CACHE_TTL = 30 * 24 * 3600
+JSON_BLOCK_RE = re.compile(r'[\[{].*[\]}]', re.S) # Outermost JSON object or array in a reply
+
+# The instructions are sent as a fixed system message so that providers with prompt caching
+# can reuse them; only the user message (headline and body) changes per request.
+SYSTEM_PROMPT = """Act as a friendly and funny Thai football blogger. Your goal is to take a news article and make it exciting for Thai football fans.
+    Please perform the following tasks on the article you are given:
+    1. Translate the entire article (headline and body) into Thai.
+    2. Rewrite the translated article in a fun, engaging, and informal style.
+    3. Structure your response as a JSON object with two keys: "headline_th" and "body_th_styled".
+    """
+PROMPT_TEMPLATE = """Here is the article: Headline: "{headline}" Body: {body}"""
+
+# Batched variant; the articles are passed as a JSON array
+BATCH_SYSTEM_PROMPT = """Act as a friendly and funny Thai football blogger. Your goal is to take news articles and make them exciting for Thai football fans.
+    You will be given a JSON array of articles, each an object with "i", "headline" and "body". For each article, please perform the following tasks:
+    1. Translate the entire article (headline and body) into Thai.
+    2. Rewrite the translated article in a fun, engaging, and informal style.
+    3. Structure your response as a JSON array with one object per input article, each with three keys: "i" (copied from the input article), "headline_th" and "body_th_styled".
+    """
+BATCH_PROMPT_TEMPLATE = """Here are {count} articles: {articles}"""
+
+LEAGUES = {'eng.1': 'Premier League', 'esp.1': 'La Liga', 'ger.1': 'Bundesliga', 'ita.1': 'Serie A'}
+MAX_POSTS_PER_RUN = 5
+PREFETCH_ARTICLES = 10 # Candidates scraped up front; a few more than the post cap to cover failures
+SCRAPE_WORKERS = 8
+MAX_CANDIDATES = 20 # Newest postable feed entries considered per run (feeds return 3 per league)
+MIN_DESCRIPTION_CHARS = 500 # A feed description at least this long is used instead of scraping the page
+ARTICLE_CACHE_TTL = 24 * 3600 # Scraped bodies reused by later runs, e.g. after a failed post
+ARTICLE_CACHE_SIZE = 256
+ARTICLE_CACHE = {} # article_url -> (scraped_at, content), oldest first
+ARTICLE_CACHE_LOCK = threading.Lock()
+# Compiled once; tried in priority order
+CONTENT_SELECTORS = [soupsieve.compile(selector) for selector in ('div.article-body', 'div.story-body', 'article')]
+# Lets the parser skip everything outside the usual article containers (nav, ads, scripts)
+ARTICLE_STRAINER = SoupStrainer(['div', 'article'], attrs={'class': re.compile(r'article-body|story-body')})
+MAX_IMAGE_BYTES = 10 * 1024 * 1024 # Facebook rejects photos above 10 MB anyway
+
+# Retry/backoff settings for the non-idempotent OpenRouter and Facebook calls
+OPENROUTER_CALLS_PER_MINUTE = 20
+TRANSLATE_WORKERS = 3 # Concurrent per-article requests when a batch has to be split up
+OPENROUTER_MAX_ATTEMPTS = 4
+OPENROUTER_RETRY_STATUSES = {429, 500, 502, 503, 504}
+FACEBOOK_MAX_ATTEMPTS = 3
+FACEBOOK_RETRY_CODES = {1, 2, 4, 17, 341} # Unknown/service/rate-limit errors worth retrying
+FACEBOOK_IMAGE_ERROR_CODE = 324 # Missing or invalid image file
+BACKOFF_BASE = 2.0
+BACKOFF_JITTER = 1.0
+MAX_BACKOFF = 60.0
+
+REQUEST_TIMEOUT = 10 # Seconds, for the ESPN feed and article pages
+IMAGE_TIMEOUT = 15
+FACEBOOK_TIMEOUT = 60 # Graph API posts; Facebook fetches the image from its URL within this call
+OPENROUTER_TIMEOUT = (10, 180) # Connect, read; a batched translation can take minutes to generate
+
+# Shared HTTP session so ESPN, article, OpenRouter and image requests reuse
+# pooled keep-alive connections instead of a fresh TCP+TLS handshake each.
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, deflate'})
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# One connection for the life of the process, shared by the worker threads under DB_LOCK.
+# Opened on first use by get_db() so that importing the module touches no files.
+DB = None
+DB_LOCK = threading.Lock()
+
+def init_posted_db(db):
+    """Creates the bot's tables and imports the legacy posted-articles text file once."""
+    with db:
+        db.execute("PRAGMA journal_mode=WAL") # Persistent; appends no longer rewrite the main file
+        db.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, and skips an fsync per commit
+        db.execute("CREATE TABLE IF NOT EXISTS posted (id TEXT PRIMARY KEY, ts INTEGER)")
+        db.execute("CREATE TABLE IF NOT EXISTS translations (hash BLOB PRIMARY KEY, result TEXT NOT NULL, ts INTEGER)")
+        db.execute("DELETE FROM translations WHERE ts < ?", (int(time.time() - TRANSLATION_CACHE_TTL),))
+        db.execute("CREATE TABLE IF NOT EXISTS league_state (league TEXT PRIMARY KEY, last_modified TEXT, etag TEXT, last_published TEXT)")
+        is_empty = db.execute("SELECT 1 FROM posted LIMIT 1").fetchone() is None
+        if is_empty and os.path.exists(POSTED_ARTICLES_FILE):
+            now = int(time.time())
+            with open(POSTED_ARTICLES_FILE, 'r') as f:
+                rows = [(line.strip(), now) for line in f if line.strip()]
+            db.executemany("INSERT OR IGNORE INTO posted (id, ts) VALUES (?, ?)", rows)
+            print(f"Imported {len(rows)} posted article IDs from {POSTED_ARTICLES_FILE}.")
+    if os.path.exists(LEGACY_TRANSLATION_CACHE_FILE):
+        os.remove(LEGACY_TRANSLATION_CACHE_FILE)
+        print(f"Removed the old translation cache {LEGACY_TRANSLATION_CACHE_FILE}.")
+
+def get_db():
+    """Returns the shared connection, opening and initialising posted_articles.db on first use."""
+    global DB
+    with DB_LOCK:
+        if DB is None:
+            db = sqlite3.connect(POSTED_DB_FILE, check_same_thread=False)
+            init_posted_db(db)
+            DB = db
+        return DB
 
 def load_posted_ids():
-    if not os.path.exists(POSTED_ARTICLES_FILE):
-        return set()
-    with open(POSTED_ARTICLES_FILE, 'r') as f:
-        return set(line.strip() for line in f if line.strip())
+    db = get_db()
+    with DB_LOCK:
+        return set(row[0] for row in db.execute("SELECT id FROM posted"))
 
 def save_posted_id(article_id):
-    with open(POSTED_ARTICLES_FILE, 'a') as f:
-        f.write(str(article_id) + "\n")
+    db = get_db()
+    with DB_LOCK, db:
+        db.execute("INSERT OR IGNORE INTO posted (id, ts) VALUES (?, ?)", (str(article_id), int(time.time())))
+
+def load_league_state():
+    """Returns {league_code: (last_modified, etag, last_published)} recorded by earlier runs."""
+    db = get_db()
+    with DB_LOCK:
+        rows = db.execute("SELECT league, last_modified, etag, last_published FROM league_state")
+        return {league: (last_modified, etag, last_published) for league, last_modified, etag, last_published in rows}
+
+def save_league_state(state):
+    db = get_db()
+    with DB_LOCK, db:
+        db.executemany(
+            "INSERT OR REPLACE INTO league_state (league, last_modified, etag, last_published) VALUES (?, ?, ?, ?)",
+            [(league, *fields) for league, fields in state.items()],
+        )
 
 def load_posted_image_urls():
     """Reads the file of posted image URLs and returns them as a set."""
@@ -37,186 +183,468 @@ def save_posted_image_url(image_url):
     with open(POSTED_IMAGES_FILE, 'a') as f:
         f.write(str(image_url) + "\n")
 
+def translation_cache_key(headline, body):
+    """Identifies a translation by the model, prompt version and the exact article it was given."""
+    text = f"{OPENROUTER_MODEL}\n{PROMPT_VERSION}\n{headline}\n{body}"
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def get_cached_translation(cache_key):
+    """Returns the stored translation for cache_key if it is younger than TRANSLATION_CACHE_TTL."""
+    cutoff = int(time.time() - TRANSLATION_CACHE_TTL)
+    db = get_db()
+    with DB_LOCK:
+        row = db.execute("SELECT result FROM translations WHERE hash = ? AND ts >= ?", (cache_key, cutoff)).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+def cache_translation(cache_key, styled_content):
+    db = get_db()
+    with DB_LOCK, db:
+        db.execute(
+            "INSERT OR REPLACE INTO translations (hash, result, ts) VALUES (?, ?, ?)",
+            (cache_key, orjson.dumps(styled_content).decode(), int(time.time())),
+        )
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retrying: the server's Retry-After if given, else jittered exponential backoff."""
+    if retry_after:
+        try:
+            return min(MAX_BACKOFF, float(retry_after))
+        except ValueError:
+            pass # HTTP-date form; fall back to our own schedule
+    return min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_JITTER)
+
+def rate_limited(max_calls, period=60.0):
+    """Decorator that blocks so that at most max_calls calls start within any period seconds."""
+    def decorator(func):
+        lock = threading.Lock()
+        call_times = deque()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with lock:
+                now = time.monotonic()
+                while call_times and now - call_times[0] >= period:
+                    call_times.popleft()
+                if len(call_times) >= max_calls:
+                    time.sleep(period - (now - call_times[0]))
+                    call_times.popleft()
+                call_times.append(time.monotonic())
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@rate_limited(OPENROUTER_CALLS_PER_MINUTE)
+def openrouter_request(api_key, payload):
+    return SESSION.post(url=OPENROUTER_URL, headers={"Authorization": f"Bearer {api_key}"}, json=payload, timeout=OPENROUTER_TIMEOUT)
+
+def is_openrouter_unavailable(error):
+    """True if a failed request would fail the same way for any prompt: network, auth, rate limit or server errors."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True # Connection error or timeout
+    return response.status_code in (401, 429) or response.status_code >= 500
+
+def call_openrouter(api_key, payload):
+    """Sends a chat completion, retrying rate-limit and server errors with backoff."""
+    for attempt in range(OPENROUTER_MAX_ATTEMPTS):
+        response = openrouter_request(api_key, payload)
+        if response.status_code not in OPENROUTER_RETRY_STATUSES or attempt == OPENROUTER_MAX_ATTEMPTS - 1:
+            response.raise_for_status() # Raise an exception for bad status codes
+            return response
+        delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+        print(f"OpenRouter returned {response.status_code}, retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
+
+def is_styled(result):
+    return isinstance(result, dict) and 'headline_th' in result and 'body_th_styled' in result
+
+def parse_model_json(content):
+    """Parses the JSON value in a model reply, ignoring any code fence or prose around it."""
+    try:
+        return orjson.loads(content) # Most replies are bare JSON
+    except orjson.JSONDecodeError:
+        match = JSON_BLOCK_RE.search(content)
+        if not match:
+            raise
+        return orjson.loads(match.group(0))
+
+def request_styled_content(api_key, system_prompt, prompt):
+    """
+    Sends a prompt to OpenRouter and returns the JSON value the model answered with,
+    or None if the reply could not be parsed. Raises requests.exceptions.RequestException
+    if the request itself failed, so callers can tell an unreachable API from a bad reply.
+    """
+    response = call_openrouter(api_key, {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    })
+
+    try:
+        # Extract the content from the response
+        response_data = orjson.loads(response.content)
+        content = response_data['choices'][0]['message']['content']
+
+        # The model should return a JSON string, so we parse it
+        return parse_model_json(content)
+
+    except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+        print(f"Error parsing response from OpenRouter: {e}")
+        # Also print the raw content to help debug
+        print(f"Raw response content: {response.text}")
+        return None
+
 def translate_and_style_article(article):
     """
     Translates and styles an article using the OpenRouter.ai API.
+    Results are cached by article content, so a previously seen article is not sent again.
     """
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    headline = article['headline']
+    body = article['body']
+    cache_key = translation_cache_key(headline, body)
+    cached = get_cached_translation(cache_key)
+    if cached:
+        print(f"Using cached translation for: \"{headline}\"")
+        return cached
+
+    api_key = CONFIG.openrouter_api_key
     if not api_key:
         print("Skipping translation: OPENROUTER_API_KEY not found in .env file.")
         return None
 
-    headline = article['headline']
-    body = article['body']
     print(f"Translating and styling with OpenRouter: \"{headline}\"")
 
-    # The same prompt as before, asking for a JSON object
-    prompt = f"""Act as a friendly and funny Thai football blogger. Your goal is to take a news article and make it exciting for Thai football fans.
-    Here is the article: Headline: "{headline}" Body: {body}
-    Please perform the following tasks:
-    1. Translate the entire article (headline and body) into Thai.
-    2. Rewrite the translated article in a fun, engaging, and informal style.
-    3. Structure your response as a JSON object with two keys: "headline_th" and "body_th_styled".
+    prompt = PROMPT_TEMPLATE.format_map({'headline': headline, 'body': body})
+    try:
+        styled_content = request_styled_content(api_key, SYSTEM_PROMPT, prompt)
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred calling OpenRouter API: {e}")
+        return None
+    if not is_styled(styled_content):
+        if styled_content is not None:
+            print(f"Unexpected response shape from OpenRouter: {styled_content!r}")
+        return None
+
+    print("Successfully translated and styled with OpenRouter.")
+    cache_translation(cache_key, styled_content)
+    return styled_content
+
+def align_batch_results(styled_list, indices):
+    """Maps a batched answer back to article indices via its "i" keys; None unless every index is answered."""
+    if not isinstance(styled_list, list) or len(styled_list) != len(indices):
+        return None
+    styled_by_index = {}
+    for styled_content in styled_list:
+        if not is_styled(styled_content) or styled_content.get('i') not in indices:
+            return None
+        styled_by_index[styled_content['i']] = styled_content
+    return styled_by_index if len(styled_by_index) == len(indices) else None
+
+def translate_and_style_batch(articles):
+    """
+    Translates and styles several articles with a single OpenRouter request.
+    Returns one result per article (None where translation failed), in input order.
+    Falls back to one request per article if the batched answer fails validation or the
+    batch is rejected with a client error; if OpenRouter is unreachable, rate-limiting or
+    failing, every uncached article stays None.
     """
+    results = [None] * len(articles)
+    pending = []
+    for i, article in enumerate(articles):
+        cache_key = translation_cache_key(article['headline'], article['body'])
+        cached = get_cached_translation(cache_key)
+        if cached:
+            print(f"Using cached translation for: \"{article['headline']}\"")
+            results[i] = cached
+        else:
+            pending.append((i, cache_key))
 
-    try:
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            data=json.dumps({
-                "model": "openai/gpt-oss-20b:free", # Using the specified free model from user's cURL
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            })
-        )
-        response.raise_for_status() # Raise an exception for bad status codes
+    api_key = CONFIG.openrouter_api_key
+    if len(pending) > 1 and api_key:
+        print(f"Translating and styling {len(pending)} articles with OpenRouter in one request.")
+        batch = [{'i': i, 'headline': articles[i]['headline'], 'body': articles[i]['body']} for i, _ in pending]
+        prompt = BATCH_PROMPT_TEMPLATE.format_map({'count': len(batch), 'articles': orjson.dumps(batch).decode()})
+        try:
+            styled_list = request_styled_content(api_key, BATCH_SYSTEM_PROMPT, prompt)
+        except requests.exceptions.RequestException as e:
+            print(f"An error occurred calling OpenRouter API: {e}")
+            if is_openrouter_unavailable(e):
+                # Retrying article by article would only hit the same failing API harder;
+                # leave these articles untranslated so the next run picks them up.
+                return results
+            styled_list = None # Rejected payload (e.g. too long); per-article requests isolate the bad article
+        styled_by_index = align_batch_results(styled_list, [i for i, _ in pending])
+        if styled_by_index:
+            for i, cache_key in pending:
+                styled_content = {key: value for key, value in styled_by_index[i].items() if key != 'i'}
+                cache_translation(cache_key, styled_content)
+                results[i] = styled_content
+            print("Successfully translated and styled the batch with OpenRouter.")
+            return results
+        print("Could not use the batched translation, falling back to one request per article.")
 
-        # Extract the content from the response
-        response_data = response.json()
-        content = response_data['choices'][0]['message']['content']
+    # Per-article requests are independent; overlap them, still paced by the rate limiter
+    with ThreadPoolExecutor(max_workers=TRANSLATE_WORKERS) as executor:
+        styled_results = executor.map(translate_and_style_article, [articles[i] for i, _ in pending])
+        for (i, _), styled_content in zip(pending, styled_results):
+            results[i] = styled_content
+    return results
 
-        # The model should return a JSON string, so we parse it
-        styled_content = json.loads(content)
+def download_image(image_url):
+    """Streams an image into memory, aborting once it grows past MAX_IMAGE_BYTES."""
+    buf = io.BytesIO()
+    with SESSION.get(image_url, stream=True, timeout=IMAGE_TIMEOUT) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(65536):
+            buf.write(chunk)
+            if buf.tell() > MAX_IMAGE_BYTES:
+                raise ValueError(f"Image exceeds {MAX_IMAGE_BYTES} bytes: {image_url}")
+    buf.seek(0)
+    return buf
 
-        print("Successfully translated and styled with OpenRouter.")
-        return styled_content
+def is_image_fetch_error(e):
+    """True if Facebook rejected the photo because it could not fetch or read the image at its URL."""
+    code = getattr(e, 'code', None)
+    if code == FACEBOOK_IMAGE_ERROR_CODE:
+        return True
+    # Invalid parameter; only the url parameter means the image itself was the problem
+    return code == 100 and 'url' in str(e).lower()
 
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred calling OpenRouter API: {e}")
-        return None
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        print(f"Error parsing response from OpenRouter: {e}")
-        # Also print the raw content to help debug
-        print(f"Raw response content: {response.text}")
-        return None
+def publish_photo(graph, page_id, image_url, message):
+    """Has Facebook fetch the image from its URL, uploading the bytes ourselves only if it could not."""
+    import facebook
+    try:
+        graph.put_object(parent_object=page_id, connection_name='photos', url=image_url, message=message)
+    except facebook.GraphAPIError as e:
+        if not is_image_fetch_error(e):
+            raise # Token, permission and message errors would fail the upload the same way
+        print(f"Facebook could not fetch the image URL ({e}), uploading the image instead.")
+        graph.put_photo(image=download_image(image_url), message=message, album_path=f'{page_id}/photos')
 
 def post_to_facebook(article_data):
-    page_id = os.getenv("FACEBOOK_PAGE_ID")
-    access_token = os.getenv("FACEBOOK_ACCESS_TOKEN")
+    import facebook # Only needed when posting; keeps `import app` light
+    page_id = CONFIG.facebook_page_id
+    access_token = CONFIG.facebook_access_token
     if not page_id or not access_token:
         print("Skipping Facebook post: Credentials not found.")
         return False
     try:
         print(f"Posting to Facebook page: {page_id}")
-        graph = facebook.GraphAPI(access_token)
+        graph = facebook.GraphAPI(access_token, timeout=FACEBOOK_TIMEOUT, session=SESSION)
         source_text = article_data.get('source', 'ESPN')
         message = f"{article_data['headline_th']}\n\n{article_data['body_th_styled']}\n\n---\nขอขอบคุณภาพข่าวจาก : {source_text}\nลิงค์ข่าว : {article_data['url']}"
-        image_response = requests.get(article_data['image_url'])
-        image_response.raise_for_status()
-        graph.put_photo(image=image_response.content, message=message, album_path=f'{page_id}/photos')
+        for attempt in range(FACEBOOK_MAX_ATTEMPTS):
+            try:
+                publish_photo(graph, page_id, article_data['image_url'], message)
+                break
+            except facebook.GraphAPIError as e:
+                if getattr(e, 'code', None) not in FACEBOOK_RETRY_CODES or attempt == FACEBOOK_MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"Facebook API transient error (code {e.code}), retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
         print("Successfully posted to Facebook.")
         return True
     except Exception as e:
         print(f"Facebook API Error: {e}")
         return False
 
+def find_article_body(soup):
+    for selector in CONTENT_SELECTORS:
+        article_body = selector.select_one(soup)
+        if article_body:
+            return article_body
+    return None
+
+def parse_article_html(html):
+    """Extracts the article's paragraph text from a page; CPU-only, no I/O."""
+    soup = BeautifulSoup(html, 'lxml', parse_only=ARTICLE_STRAINER)
+    article_body = find_article_body(soup)
+    if not article_body:
+        # Unusual layout: parse the whole page and fall back to all of its paragraphs
+        soup = BeautifulSoup(html, 'lxml')
+        article_body = find_article_body(soup)
+    if not article_body:
+        paragraphs = soup.find('body').find_all('p')
+    else:
+        paragraphs = article_body.find_all('p')
+    texts = (p.get_text().strip() for p in paragraphs)
+    content = "\n\n".join(text for text in texts if text)
+    return content if content else None
+
 def get_article_content(article_url):
+    with ARTICLE_CACHE_LOCK:
+        cached = ARTICLE_CACHE.get(article_url)
+    if cached and time.time() - cached[0] < ARTICLE_CACHE_TTL:
+        print(f"Using cached article content for: {article_url}")
+        return cached[1]
+
     print(f"Scraping article content from: {article_url}")
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(article_url, headers=headers)
+        response = SESSION.get(article_url, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        content_selectors = ['div.article-body', 'div.story-body', 'article']
-        article_body = None
-        for selector in content_selectors:
-            article_body = soup.select_one(selector)
-            if article_body:
-                break
-        if not article_body:
-            paragraphs = soup.find('body').find_all('p')
-        else:
-            paragraphs = article_body.find_all('p')
-        content = "\n\n".join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-        return content if content else None
+        content = parse_article_html(response.content)
     except Exception as e:
         print(f"Error scraping content from {article_url}: {e}")
         return None
+    if content:
+        with ARTICLE_CACHE_LOCK:
+            ARTICLE_CACHE.pop(article_url, None)
+            ARTICLE_CACHE[article_url] = (time.time(), content)
+            while len(ARTICLE_CACHE) > ARTICLE_CACHE_SIZE:
+                ARTICLE_CACHE.pop(next(iter(ARTICLE_CACHE)))
+    return content
+
+def get_article_body(article_summary, article_url):
+    """Uses the feed's description when it is long enough, otherwise scrapes the article page."""
+    description = (article_summary.get('description') or '').strip()
+    if len(description) >= MIN_DESCRIPTION_CHARS:
+        return description
+    return get_article_content(article_url)
 
-def get_espn_news():
-    leagues = {'eng.1': 'Premier League', 'esp.1': 'La Liga', 'ger.1': 'Bundesliga', 'ita.1': 'Serie A'}
-    all_articles = []
+def fetch_league_news(league_code, league_name, previous_state):
+    """
+    Fetches one league's feed. Returns (articles, new_state); new_state is None when
+    nothing new was received.
+    """
+    last_modified, etag, last_published = previous_state
+    api_url = f"http://site.api.espn.com/apis/site/v2/sports/soccer/{league_code}/news?limit=3"
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = SESSION.get(api_url, headers=headers, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        if response.status_code == 304:
+            print(f"No new articles for {league_name} (not modified).")
+            return [], None
+        data = orjson.loads(response.content)
+        api_articles = data.get('articles', [])
+        print(f"Found {len(api_articles)} articles for {league_name}.")
+        # Only keep articles published after the newest one handled by a previous run
+        api_articles = [a for a in api_articles if a.get('published', '') > last_published]
+        for article in api_articles:
+            article['source'] = 'ESPN'
+            article['league'] = league_name
+            article['league_code'] = league_code
+        newest = max((a.get('published', '') for a in api_articles), default=last_published)
+        return api_articles, (response.headers.get('Last-Modified'), response.headers.get('ETag'), newest)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        print(f"Could not fetch news for {league_name}. Error: {e}")
+        return [], None
+
+def get_espn_news(league_state=None):
+    """
+    Fetches every league in LEAGUES. Returns (articles, new_state) where new_state maps
+    league codes to the conditional-request state to persist once they are handled.
+    """
+    league_state = league_state or {}
     print("Fetching news from ESPN API for all specified leagues...")
-    for league_code, league_name in leagues.items():
-        api_url = f"http://site.api.espn.com/apis/site/v2/sports/soccer/{league_code}/news?limit=3"
-        try:
-            response = requests.get(api_url)
-            response.raise_for_status()
-            data = response.json()
-            api_articles = data.get('articles', [])
-            print(f"Found {len(api_articles)} articles for {league_name}.")
-            for article in api_articles:
-                article['source'] = 'ESPN'
-                article['league'] = league_name
-            all_articles.extend(api_articles)
-        except requests.exceptions.RequestException as e:
-            print(f"Could not fetch news for {league_name}. Error: {e}")
-    return all_articles
+    previous = [league_state.get(code, (None, None, '')) for code in LEAGUES]
+    # The league endpoints are independent, so fetch them concurrently.
+    with ThreadPoolExecutor(max_workers=len(LEAGUES)) as executor:
+        results = list(executor.map(fetch_league_news, LEAGUES.keys(), LEAGUES.values(), previous))
+    all_articles = [article for league_articles, _ in results for article in league_articles]
+    new_state = {code: state for code, (_, state) in zip(LEAGUES, results) if state}
+    return all_articles, new_state
+
+def article_image_url(article):
+    images = article.get('images') or [{}]
+    return (images[0] or {}).get('url')
+
+def article_web_url(article):
+    return article.get('links', {}).get('web', {}).get('href')
 
 def run_full_job():
-    global current_key_index
-    current_key_index = 0 # Reset to the first key for every new job run
     print(f"\n--- Running scheduled job at {datetime.now()} ---")
-    print("API Key index reset to 0.")
-    # The configure_gemini() call is no longer needed here, it will be handled by the translation function
     posted_ids = load_posted_ids()
     posted_image_urls = load_posted_image_urls()
     print(f"Loaded {len(posted_ids)} posted article IDs and {len(posted_image_urls)} posted image URLs.")
 
-    raw_articles = get_espn_news()
-    articles_no_videos = [a for a in raw_articles if a.get('type') != 'Media']
-    sorted_articles = sorted(articles_no_videos, key=lambda x: x.get('published', ''), reverse=True)
-    print(f"Found {len(sorted_articles)} valid articles to process.")
-    new_posts_made = 0
-    for article_summary in sorted_articles:
-        if new_posts_made >= 5:
-            print("Posted 5 new articles. Ending job run.")
-            break
-
-        # Deduplication Check 1: Article ID
-        article_id = str(article_summary.get('id'))
-        if article_id in posted_ids:
-            continue
-
-        # Prepare image URL for Deduplication Check 2
-        image_url = (article_summary.get('images', [{}])[0] or {}).get('url')
-        if not image_url:
-            print(f"Skipping article \"{article_summary.get('headline')}\" due to missing image URL.")
-            continue
-
+    raw_articles, new_league_state = get_espn_news(load_league_state())
+    # Only the newest few articles can ever be posted, so pick them with a bounded heap
+    # rather than sorting the whole feed. Videos, entries without image or link and
+    # already-posted IDs (Deduplication Check 1) are dropped first so they never use a slot.
+    postable = (
+        (a, str(a.get('id')), article_image_url(a), article_web_url(a))
+        for a in raw_articles if a.get('type') != 'Media'
+    )
+    unposted = [p for p in postable if p[1] not in posted_ids and p[2] and p[3]]
+    newest = heapq.nlargest(MAX_CANDIDATES, unposted, key=lambda p: p[0].get('published', ''))
+    print(f"Found {len(newest)} valid articles to process.")
+    candidates = []
+    for article_summary, article_id, image_url, article_url in newest:
         # Deduplication Check 2: Image URL
         if image_url in posted_image_urls:
             print(f"Skipping article \"{article_summary.get('headline')}\" due to duplicate image URL.")
             continue
 
-        print(f"\n--- Processing new article from {article_summary.get('league')}: \"{article_summary.get('headline')}\" ---")
-        article_url = article_summary.get('links', {}).get('web', {}).get('href')
-        if not article_url:
-            continue
-        full_content = get_article_content(article_url)
-        if not full_content:
-            continue
+        candidates.append((article_summary, article_id, image_url, article_url))
+
+    # Get the first candidates' bodies concurrently; results come back in input order.
+    to_scrape = candidates[:PREFETCH_ARTICLES]
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+        contents = list(executor.map(get_article_body, [c[0] for c in to_scrape], [c[3] for c in to_scrape]))
+
+    scraped = []
+    for (article_summary, article_id, image_url, article_url), full_content in zip(to_scrape, contents):
+        if full_content:
+            final_article = {'id': article_id, 'headline': article_summary.get('headline'), 'url': article_url, 'image_url': image_url, 'body': full_content, 'source': 'ESPN'}
+            scraped.append((article_summary, final_article))
 
-        final_article = {'id': article_id, 'headline': article_summary.get('headline'), 'url': article_url, 'image_url': image_url, 'body': full_content, 'source': 'ESPN'}
-        styled_result = translate_and_style_article(final_article)
-        if styled_result:
+    new_posts_made = 0
+    # Translate as many articles as there are posts left in one request, topping up after failures
+    while scraped and new_posts_made < MAX_POSTS_PER_RUN:
+        remaining = MAX_POSTS_PER_RUN - new_posts_made
+        batch, scraped = scraped[:remaining], scraped[remaining:]
+        styled_results = translate_and_style_batch([final_article for _, final_article in batch])
+        if not any(styled_results):
+            print("No articles could be translated, leaving the rest for the next run.")
+            break
+        for (article_summary, final_article), styled_result in zip(batch, styled_results):
+            print(f"\n--- Processing new article from {article_summary.get('league')}: \"{article_summary.get('headline')}\" ---")
+            if not styled_result:
+                continue
             styled_result.update(final_article)
             post_successful = post_to_facebook(styled_result)
             if post_successful:
+                article_id = final_article['id']
                 save_posted_id(article_id)
-                save_posted_image_url(image_url)
+                save_posted_image_url(final_article['image_url'])
+                posted_ids.add(article_id)
                 print(f"Saved article ID {article_id} and image URL to history.")
                 new_posts_made += 1
                 print("Waiting for 5 seconds before next API call to avoid rate limiting...")
                 time.sleep(5)
+    if new_posts_made >= MAX_POSTS_PER_RUN:
+        print(f"Posted {MAX_POSTS_PER_RUN} new articles. Ending job run.")
+
+    # Advance a league's watermark only once none of its new articles are left unposted,
+    # so articles skipped by the candidate or post cap or a transient failure are retried next run.
+    # Articles with an already-posted image can never be posted and do not hold a league back.
+    unsettled = {
+        article_summary['league_code'] for article_summary, article_id, image_url, _ in unposted
+        if article_id not in posted_ids and image_url not in posted_image_urls
+    }
+    save_league_state({code: state for code, state in new_league_state.items() if code not in unsettled})
     print("--- Scheduled job finished ---")
 
 if __name__ == '__main__':
-    scheduler = BlockingScheduler(timezone="Asia/Bangkok")
+    from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerExecutor
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    # If the scheduler itself wakes up late (e.g. after the host was suspended), a trigger
+    # up to 30 minutes overdue still runs, and several overdue triggers run only once.
+    # A trigger that fires while a run is still going is skipped (max_instances=1); with
+    # 3-5 hour gaps between triggers, a run overlapping the next one is not a real risk.
+    scheduler = BlockingScheduler(
+        timezone="Asia/Bangkok",
+        executors={'default': SchedulerExecutor(1)},
+        job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 1800},
+    )
     scheduler.add_job(run_full_job, 'cron', hour='1,4,8,12,16,21')
     print("Scheduler started. Press Ctrl+C to exit.")
     try: